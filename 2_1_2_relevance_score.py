@@ -8,16 +8,30 @@
 #       python 2_1_2_relevance_score.py --chunks path/to/dir
 # ④  Optional: specify Q&A path and score directory:
 #       python 2_1_2_relevance_score.py --qa-path path/to/qa.json --score-dir path/to/scores
+# ⑤  Optional: number of requests kept in flight at once:
+#       python 2_1_2_relevance_score.py --concurrency 20
+# ⑥  Bulk run via the Batch API (½ price, results within 24 h):
+#       python 2_1_2_relevance_score.py --batch
 # --------------------------------------------------------------------
-import json, pathlib, argparse
+import pathlib, argparse, asyncio, random, hashlib, shutil, mmap
 from typing import Optional, List, Dict
 import dotenv, os
-from openai import OpenAI
+import httpx
+import ijson
+import orjson
+from openai import AsyncOpenAI, APIConnectionError, InternalServerError, RateLimitError
 from pydantic import BaseModel, Field, ValidationError
 
 # ── OpenAI client ───────────────────────────────────────────────────
 dotenv.load_dotenv()
-client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+client: Optional[AsyncOpenAI] = None     # built in score_all() once --concurrency is known
+
+MODEL       = "gpt-4o-mini"
+MAX_RETRIES = 6                          # attempts per chunk on 429 / 5xx / timeout / connection error
+BATCH_POLL_SECONDS = 60                  # how often --batch checks the job status
+BATCH_MAX_REQUESTS = 50_000              # Batch API limit: requests per input file …
+BATCH_MAX_BYTES    = 190 * 2**20         # … and 200 MB per input file (minus headroom)
+ID_CACHE_NAME      = ".chunk_ids.cache"  # sidecar in the chunk folder: file → chunk_id
 
 # ── schema for ONE item inside the returned array ──────────────────
 class PairScore(BaseModel):
@@ -39,36 +53,340 @@ Scoring rubric
  0.2 tangential · 0.0 unrelated
 """.strip()
 
-# ── prompt builder (chunk + 25 questions) ──────────────────────────
-def build_user_prompt(chunk: dict,
-                      qa_items: List[dict],
-                      with_answer: bool) -> str:
+# ── prompt builders ────────────────────────────────────────────────
+# The 25 questions are identical for every chunk, so they go into the
+# system message: OpenAI caches repeated prompt *prefixes*, and only the
+# chunk-specific user message varies between requests.
+def build_system_prompt(qa_items: List[dict],
+                        with_answer: bool) -> str:
+    lines = [SYS_PROMPT, "", "### Questions (25)"]
+    for q in qa_items:
+        lines.append(f"{q['id']}. EN: {q['question']} / DE: {q['question_de']}")
+        if with_answer:
+            lines.append(f"   answers → EN: {q['answer']} / DE: {q['answer_de']}")
+    return "\n".join(lines).strip()
+
+def build_user_prompt(chunk: dict) -> str:
     lines = [
         "### Chunk ID",
         chunk["metadata"]["chunk_id"],
         "",
         "### Chunk text",
-        chunk["text"],
-        "",
-        "### Questions (25)"
+        chunk["text"]
     ]
-    for q in qa_items:
-        lines.append(f"{q['id']}. EN: {q['question']} / DE: {q['question_de']}")
-        if with_answer:
-            lines.append(f"   answers → EN: {q['answer']} / DE: {q['answer_de']}")
     return "\n".join(lines).strip()
 
+# ── JSON straight from the page cache (no intermediate bytes copy) ──
+def load_json_mmap(path: pathlib.Path):
+    with path.open("rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:       # mmap can't map empty files
+            return orjson.loads(b"")                # → JSONDecodeError as usual
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+             memoryview(mm) as view:
+            return orjson.loads(view)
+
+# ── chunk file → chunk_id, cached so unchanged files are never parsed ─
+def chunk_ids(chunk_dir: pathlib.Path) -> Dict[pathlib.Path, str]:
+    """
+    Map every chunk JSON to its metadata.chunk_id. The mapping is kept in
+    a sidecar file keyed by (name, size, mtime); only new or modified
+    chunks are opened, and those are stream-parsed just far enough to
+    reach the id – the (large) chunk text is never materialised.
+    """
+    cache_path = chunk_dir / ID_CACHE_NAME
+    try:
+        cache: Dict[str, list] = orjson.loads(cache_path.read_bytes())
+    except (OSError, orjson.JSONDecodeError):
+        cache = {}
+
+    ids: Dict[pathlib.Path, str] = {}
+    fresh: Dict[str, list] = {}
+    for fp in chunk_dir.glob("*.json"):
+        st = fp.stat()
+        entry = cache.get(fp.name)
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            cid = entry[2]
+        else:
+            with fp.open("rb") as f:
+                cid = next(ijson.items(f, "metadata.chunk_id"), None)
+            if cid is None:
+                raise KeyError(f"{fp}: no metadata.chunk_id")
+        fresh[fp.name] = [st.st_size, st.st_mtime_ns, cid]
+        ids[fp] = cid
+
+    if fresh != cache:
+        try:
+            tmp_path = cache_path.with_suffix(".tmp")
+            tmp_path.write_bytes(orjson.dumps(fresh))
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass  # read-only chunk folder → just no cache next time
+    return ids
+
 # ── NEW helper: which chunks *still* need a score file? ────────────
 def chunks_missing_scores(chunk_dir: pathlib.Path,
-                          score_dir: pathlib.Path) -> List[pathlib.Path]:
-    """Return raw-chunk JSONs that have no score file yet."""
-    todo: List[pathlib.Path] = []
-    for fp in chunk_dir.glob("*.json"):
-        with fp.open(encoding="utf-8") as f:
-            cid = json.load(f)["metadata"]["chunk_id"]
-        if not (score_dir / f"{cid}.json").exists():
-            todo.append(fp)
-    return sorted(todo)
+                          score_dir: pathlib.Path) -> Dict[pathlib.Path, str]:
+    """Return {raw-chunk JSON: chunk_id} for chunks that have no score file yet."""
+    return {fp: cid
+            for fp, cid in sorted(chunk_ids(chunk_dir).items())
+            if not (score_dir / f"{cid}.json").exists()}
+
+# ── model reply → {question_id: score}  (None = reject chunk) ──────
+def parse_scores(cid: str, content: Optional[str]) -> Optional[Dict[str, dict]]:
+    """Decode the returned JSON array and validate every item as PairScore."""
+    if content is None:
+        print("✗ empty reply for", cid)
+        return None
+    try:
+        arr = orjson.loads(content)
+    except orjson.JSONDecodeError as e:
+        print("✗ JSON decode error for", cid, "→", e)
+        return None
+    if not isinstance(arr, list):
+        print(f"✗ {cid}: expected a JSON array, got {type(arr).__name__} – skipping")
+        return None
+
+    chunk_result: Dict[str, dict] = {}
+    for item in arr:
+        if not isinstance(item, dict):
+            print("✗ validation error for", cid, item, "→ not a JSON object")
+            return None
+        try:
+            ps = PairScore(**item)
+        except ValidationError as ve:
+            print("✗ validation error for", cid, item, "→", ve)
+            return None
+        chunk_result[str(ps.question_id)] = {
+            "relevance_score": ps.relevance_score,
+            "relevance_reason": ps.relevance_reason
+        }
+    if len(chunk_result) != 25:
+        print(f"✗ {cid}: expected 25 items, got {len(chunk_result)} – skipping")
+        return None
+    return chunk_result
+
+# ── response cache: identical (model, questions, chunk text) → reuse ─
+def cache_key(system_prompt: str, chunk_text: str) -> str:
+    """Hash everything the score depends on; the chunk id itself does not matter."""
+    h = hashlib.blake2b(digest_size=16)
+    for part in (MODEL, system_prompt, chunk_text):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def write_score(out_path: pathlib.Path,
+                chunk_result: Dict[str, dict],
+                cache_path: pathlib.Path) -> None:
+    """Write the score file and its cache entry (tmp + rename, never half-written)."""
+    payload = orjson.dumps(chunk_result, option=orjson.OPT_INDENT_2)
+    for path in (out_path, cache_path):
+        tmp = path.with_suffix(".json.tmp")
+        tmp.write_bytes(payload)
+        os.replace(tmp, path)
+
+def restore_cached(cache_path: pathlib.Path, out_path: pathlib.Path) -> None:
+    """Copy a cached result to its score file (tmp + rename, never half-written)."""
+    tmp = out_path.with_suffix(".json.tmp")
+    shutil.copyfile(cache_path, tmp)
+    os.replace(tmp, out_path)
+
+# ── one chat completion, retried with exponential backoff ──────────
+async def create_with_backoff(messages: List[dict]):
+    for attempt in range(MAX_RETRIES):
+        try:
+            return await client.chat.completions.create(model=MODEL, messages=messages)
+        # APIConnectionError includes APITimeoutError
+        except (RateLimitError, InternalServerError, APIConnectionError):
+            if attempt == MAX_RETRIES - 1:
+                raise
+            # 1 s, 2 s, 4 s, … plus jitter so throttled calls don't retry in lockstep
+            await asyncio.sleep(2 ** attempt + random.random())
+
+# ── score ONE chunk: prompt → API → validate → write ───────────────
+async def score_one(chunk_fp: pathlib.Path,
+                    system_prompt: str,
+                    score_dir: pathlib.Path,
+                    cache_dir: pathlib.Path,
+                    sem: asyncio.Semaphore) -> None:
+    """Never raises: a bad chunk must not cancel the other requests in flight."""
+    try:
+        await _score_one(chunk_fp, system_prompt, score_dir, cache_dir, sem)
+    except Exception as e:
+        print("✗ failed to score", chunk_fp.name, "→", repr(e))
+
+async def _score_one(chunk_fp: pathlib.Path,
+                     system_prompt: str,
+                     score_dir: pathlib.Path,
+                     cache_dir: pathlib.Path,
+                     sem: asyncio.Semaphore) -> None:
+    # Everything happens under the semaphore: at most `concurrency` chunks are
+    # loaded at once, and the file read runs off the event loop.
+    async with sem:
+        raw = await asyncio.to_thread(load_json_mmap, chunk_fp)
+        cid = raw["metadata"]["chunk_id"]
+        out_path = score_dir / f"{cid}.json"
+
+        cache_path = cache_dir / f"{cache_key(system_prompt, raw['text'])}.json"
+        if cache_path.exists():
+            restore_cached(cache_path, out_path)
+            print("✓ cached", cid)
+            return
+
+        user_prompt = build_user_prompt(raw)
+        del raw
+        try:
+            resp = await create_with_backoff([
+                {"role": "system", "content": system_prompt},
+                {"role": "user",   "content": user_prompt}
+            ])
+        except Exception as e:
+            print("✗ request failed for", cid, "→", e)
+            return
+
+    chunk_result = parse_scores(cid, resp.choices[0].message.content)
+    if chunk_result is None:
+        return
+    write_score(out_path, chunk_result, cache_path)
+    print("✓ scored", cid)
+
+def make_client(concurrency: int) -> AsyncOpenAI:
+    """One pooled HTTP client shared by all requests, sized to the semaphore."""
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=concurrency,
+                            max_keepalive_connections=concurrency))
+    return AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"],
+                       http_client=http_client,
+                       max_retries=0)          # create_with_backoff() is the only retry policy
+
+async def score_all(todo_files: List[pathlib.Path],
+                    system_prompt: str,
+                    score_dir: pathlib.Path,
+                    cache_dir: pathlib.Path,
+                    concurrency: int) -> None:
+    """Schedule every chunk at once; the semaphore caps chunks loaded and requests in flight."""
+    global client
+    client = make_client(concurrency)
+    sem = asyncio.Semaphore(concurrency)
+    try:
+        await asyncio.gather(*[
+            score_one(fp, system_prompt, score_dir, cache_dir, sem)
+            for fp in todo_files
+        ])
+    finally:
+        await client.close()
+
+# ── bulk alternative: Batch API jobs, split to stay under the limits ─
+async def submit_batch(lines: List[bytes]) -> str:
+    """Upload one JSONL input file and start a batch job on it."""
+    batch_file = await client.files.create(
+        file=("score_batch.jsonl", b"\n".join(lines)),
+        purpose="batch")
+    batch = await client.batches.create(input_file_id=batch_file.id,
+                                        endpoint="/v1/chat/completions",
+                                        completion_window="24h")
+    print(f"Submitted batch {batch.id} ({len(lines)} chunk(s))")
+    return batch.id
+
+async def wait_for_batch(batch_id: str):
+    batch = await client.batches.retrieve(batch_id)
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        await asyncio.sleep(BATCH_POLL_SECONDS)
+        batch = await client.batches.retrieve(batch_id)
+        print(f"  … {batch_id}: {batch.status}")
+    return batch
+
+async def collect_batch(batch,
+                        score_dir: pathlib.Path,
+                        cache_paths: Dict[str, pathlib.Path]) -> set:
+    """Write every result of a finished batch; return the custom_ids seen."""
+    if batch.status != "completed":
+        print(f"✗ batch {batch.id} ended with status '{batch.status}'")
+
+    seen = set()
+    # failed requests of a "completed" batch land in the error file, not the output
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        content = await client.files.content(file_id)
+        for line in content.text.splitlines():
+            if not line.strip():
+                continue
+            row = orjson.loads(line)
+            cid = row["custom_id"]
+            seen.add(cid)
+            resp = row.get("response") or {}
+            if row.get("error") or resp.get("status_code") != 200:
+                print("✗ request failed for", cid, "→", row.get("error") or resp.get("body"))
+                continue
+
+            chunk_result = parse_scores(cid, resp["body"]["choices"][0]["message"]["content"])
+            if chunk_result is None:
+                continue
+            write_score(score_dir / f"{cid}.json", chunk_result, cache_paths[cid])
+            print("✓ scored", cid)
+    return seen
+
+async def score_batch(todo_files: List[pathlib.Path],
+                      system_prompt: str,
+                      score_dir: pathlib.Path,
+                      cache_dir: pathlib.Path) -> None:
+    """
+    Upload the prompts as JSONL batch jobs, each within the API's per-file
+    request and size limits, wait for all of them, then write the results.
+    """
+    global client
+    client = make_client(1)
+    try:
+        batch_ids: List[str] = []
+        lines: List[bytes] = []
+        size = 0
+        cache_paths: Dict[str, pathlib.Path] = {}
+        for fp in todo_files:
+            raw = load_json_mmap(fp)
+            cid = raw["metadata"]["chunk_id"]
+            cache_path = cache_dir / f"{cache_key(system_prompt, raw['text'])}.json"
+            if cache_path.exists():
+                restore_cached(cache_path, score_dir / f"{cid}.json")
+                print("✓ cached", cid)
+                continue
+            line = orjson.dumps({
+                "custom_id": cid,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": MODEL,
+                    "messages": [
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user",   "content": build_user_prompt(raw)}
+                    ]
+                }
+            })
+            if len(line) + 1 > BATCH_MAX_BYTES:
+                print(f"✗ {cid}: request alone exceeds the batch file size limit – skipping")
+                continue
+            # current file full → upload it before adding this request
+            if lines and (len(lines) == BATCH_MAX_REQUESTS or size + len(line) + 1 > BATCH_MAX_BYTES):
+                batch_ids.append(await submit_batch(lines))
+                lines, size = [], 0
+            cache_paths[cid] = cache_path
+            lines.append(line)
+            size += len(line) + 1
+        if lines:
+            batch_ids.append(await submit_batch(lines))
+        del lines
+
+        if not batch_ids:
+            return
+        print(f"Waiting for {len(batch_ids)} batch job(s) …")
+        batches = await asyncio.gather(*[wait_for_batch(bid) for bid in batch_ids])
+
+        seen = set()
+        for batch in batches:
+            seen |= await collect_batch(batch, score_dir, cache_paths)
+        for cid in sorted(set(cache_paths) - seen):
+            print("✗ no result returned for", cid)
+    finally:
+        await client.close()
 
 # ── main ────────────────────────────────────────────────────────────
 def main() -> None:
@@ -89,7 +407,15 @@ def main() -> None:
                     help="Path to the Q&A benchmark JSON file")
     ap.add_argument("--score-dir", default=None,
                     help="Output directory for score files (default: benchmark/score/<chunk_folder_name>)")
+    ap.add_argument("--cache-dir", default=None,
+                    help="Response cache directory (default: <score_dir>/../.score_cache)")
+    ap.add_argument("--concurrency", type=int, default=16,
+                    help="Max. scoring requests in flight at once (default: 16)")
+    ap.add_argument("--batch", action="store_true",
+                    help="Submit missing chunks as Batch API job(s) instead of live calls.")
     args = ap.parse_args()
+    if args.concurrency < 1:
+        ap.error("--concurrency must be at least 1")
 
     # -------- paths -------------------------------------------------
     qa_path   = pathlib.Path(args.qa_path)
@@ -103,9 +429,14 @@ def main() -> None:
         stripped_name     = chunk_folder_name.removesuffix("_chunk")
         score_dir         = pathlib.Path("benchmark/score") / stripped_name
     score_dir.mkdir(parents=True, exist_ok=True)
+    # shared by all chunk folders: the same text scored twice costs nothing
+    cache_dir = (pathlib.Path(args.cache_dir) if args.cache_dir
+                 else score_dir.parent / ".score_cache")
+    cache_dir.mkdir(parents=True, exist_ok=True)
 
     # ---------- determine what is missing ---------------------------
-    todo_files = chunks_missing_scores(chunk_dir, score_dir)
+    missing    = chunks_missing_scores(chunk_dir, score_dir)
+    todo_files = list(missing)
 
     # ---------- MODE 1: just list & exit ----------------------------
     if args.list_missing:
@@ -113,9 +444,8 @@ def main() -> None:
             print("Everything already scored – nothing missing.")
         else:
             print(f"{len(todo_files)} chunk(s) still need scoring:")
-            for fp in todo_files:
-                with fp.open(encoding="utf-8") as f:
-                    print("-", json.load(f)["metadata"]["chunk_id"])
+            for cid in missing.values():
+                print("-", cid)
         return  # ←–––––––––––––––––––––  no token usage
 
     # ---------- (implicit) MODE 2: run scoring ----------------------
@@ -123,50 +453,18 @@ def main() -> None:
         print("All chunks already have a score file – nothing to do.")
         return
 
-    qa_items_all = json.load(qa_path.open(encoding="utf-8"))
+    qa_items_all  = load_json_mmap(qa_path)
+    system_prompt = build_system_prompt(qa_items_all, args.with_answer)
     print(f"{len(todo_files)} chunk(s) will be (re)scored …\n")
 
-    # ---------------- iterate over UN-scored chunks -----------------
-    for chunk_fp in todo_files:
-        raw   = json.load(chunk_fp.open(encoding="utf-8"))
-        cid   = raw["metadata"]["chunk_id"]
-        out_path = score_dir / f"{cid}.json"
-
-        # ---- build & send prompt -----------------------------------
-        user_prompt = build_user_prompt(raw, qa_items_all, args.with_answer)
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": SYS_PROMPT},
-                {"role": "user",   "content": user_prompt}
-            ]
-        )
-
-        # ---- parse / validate --------------------------------------
-        try:
-            arr = json.loads(resp.choices[0].message.content)
-        except json.JSONDecodeError as e:
-            print("✗ JSON decode error for", cid, "→", e)
-            continue
+    # ---------------- bulk: one Batch API job ------------------------
+    if args.batch:
+        asyncio.run(score_batch(todo_files, system_prompt, score_dir, cache_dir))
+        return
 
-        chunk_result: Dict[str, dict] = {}
-        for item in arr:
-            try:
-                ps = PairScore(**item)
-            except ValidationError as ve:
-                print("✗ validation error for", cid, item, "→", ve)
-                break
-            chunk_result[str(ps.question_id)] = {
-                "relevance_score": ps.relevance_score,
-                "relevance_reason": ps.relevance_reason
-            }
-        else:  # executes only if we did *not* break out of the loop
-            if len(chunk_result) != 25:
-                print(f"✗ {cid}: expected 25 items, got {len(chunk_result)} – skipping")
-                continue
-            with out_path.open("w", encoding="utf-8") as f:
-                json.dump(chunk_result, f, ensure_ascii=False, indent=2)
-            print("✓ scored", cid)
+    # ---------------- score UN-scored chunks concurrently -----------
+    asyncio.run(score_all(todo_files, system_prompt, score_dir, cache_dir,
+                          args.concurrency))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
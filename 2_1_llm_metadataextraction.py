@@ -4,9 +4,10 @@
 #           --chunks subsample/semantic_chunk \
 #           --meta-dir path/to/output
 # --------------------------------------------------------------------
-import json, pathlib, argparse, os
+import pathlib, argparse, os, codecs
 from typing import List, Optional, Union, Any
 import dotenv
+import orjson
 from openai import OpenAI
 from pydantic import BaseModel, Field
 
@@ -68,13 +69,11 @@ Output must be pure JSON – no markdown – and must not invent facts.
 
 # ── Helper functions ────────────────────────────────────────────────
 def load_json_utf8(path: pathlib.Path):
-    for enc in ("utf-8", "utf-8-sig"):
-        try:
-            with path.open(encoding=enc) as f:
-                return json.load(f)
-        except UnicodeDecodeError:
-            continue
-    raise RuntimeError(f"Cannot read {path} as UTF-8")
+    # orjson parses UTF-8 bytes directly; only a BOM (utf-8-sig) needs stripping
+    try:
+        return orjson.loads(path.read_bytes().removeprefix(codecs.BOM_UTF8))
+    except orjson.JSONDecodeError as e:
+        raise RuntimeError(f"Cannot read {path} as UTF-8 JSON: {e}") from e
 
 def _dedup(seq: list[str]) -> list[str]:
     seen, out = set(), []
@@ -86,21 +85,34 @@ def _dedup(seq: list[str]) -> list[str]:
 # ---------- universal *deep* lower-casing utility --------------------------- #
 def _deep_lower(obj: Any) -> Any:
     """
-    Recursively walk any JSON-serialisable structure and
-    lower-case *all* strings, deduplicating lists of strings.
+    Walk any JSON-serialisable structure and lower-case *all* strings,
+    deduplicating lists of strings. Containers are modified in place
+    using an explicit stack (no recursion, no per-level copies).
     """
     if isinstance(obj, str):
         return obj.lower()
 
-    if isinstance(obj, list):
-        lowered = [_deep_lower(v) for v in obj]
-        # If this is *now* a list of strings → de-dup
-        if all(isinstance(v, str) for v in lowered):
-            return _dedup(lowered)
-        return lowered
-
-    if isinstance(obj, dict):
-        return {k: _deep_lower(v) for k, v in obj.items()}
+    stack = [obj]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            for k, v in node.items():
+                if isinstance(v, str):
+                    node[k] = v.lower()
+                elif isinstance(v, (list, dict)):
+                    stack.append(v)
+        elif isinstance(node, list):
+            only_strings = True
+            for i, v in enumerate(node):
+                if isinstance(v, str):
+                    node[i] = v.lower()
+                else:
+                    only_strings = False
+                    if isinstance(v, (list, dict)):
+                        stack.append(v)
+            # If this is a list of strings → de-dup
+            if only_strings:
+                node[:] = _dedup(node)
 
     return obj  # numbers / None / bool stay unchanged
 
@@ -110,7 +122,7 @@ def normalise(meta: MetadataSchema) -> MetadataSchema:
     Fully lower-case every string field (except the primary `id` which
     is already lower-case by construction) and collapse double spaces.
     """
-    data = _deep_lower(meta.model_dump())               #  ‹CHANGED›
+    data = _deep_lower(meta.model_dump())     # fresh dict → safe to lower in place
 
     # collapse whitespace in the *now* lower-cased summary
     data["chunk_summary"] = " ".join(data["chunk_summary"].split())
@@ -153,8 +165,11 @@ def main() -> None:
         )
         meta = normalise(response.choices[0].message.parsed)
 
-        with out_path.open("w", encoding="utf-8") as f:
-            json.dump(meta.model_dump(), f, ensure_ascii=False, indent=2)
+        # tmp + rename: a crash never leaves a half-written file that the
+        # "already processed" check above would then skip forever
+        tmp_path = out_path.with_suffix(".json.tmp")
+        tmp_path.write_bytes(orjson.dumps(meta.model_dump(), option=orjson.OPT_INDENT_2))
+        os.replace(tmp_path, out_path)
         print("✓", cid)
 
 if __name__ == "__main__":
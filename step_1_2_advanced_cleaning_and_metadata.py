@@ -12,7 +12,7 @@ Purpose:
        - Language detection (Lingua)
        - (Optional) Date extraction from path or text
        - Named Entity Recognition (spaCy)
-       - Keyword Extraction (YAKE)
+       - Keyword Extraction (YAKE, or batched KeyBERT with --keywords keybert)
        - Summaries (simple bullet or first-two-sentence approach)
     4) Write final JSON with fields like:
         {
@@ -64,10 +64,15 @@ Example usage:
 
 import os
 import re
-import json
+import orjson
 import time
 import logging
+import heapq
+import hashlib
 import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 import dateparser
 
@@ -75,6 +80,18 @@ import spacy
 import yake
 from lingua import Language, LanguageDetectorBuilder
 
+try:
+    # Optional: RE2 matches in linear time (no backtracking) – pip install google-re2
+    import re2
+except ImportError:
+    re2 = None
+
+try:
+    # Optional: batched embedding-based keywords – pip install keybert
+    from keybert import KeyBERT
+except ImportError:
+    KeyBERT = None
+
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 
 # Build a Lingua detector for 4 languages
@@ -85,10 +102,25 @@ detector = (
     .build()
 )
 
+# Lingua only looks at this many leading characters; detection cost is linear
+# in input length and a ~2 KB prefix is as reliable as the full document
+LANG_DETECT_PREFIX = 2000
+# Memoized detect_lang results, keyed by fingerprint of the prefix
+detect_lang_cache = {}
+
 # Lazy-loaded spaCy models by language code
 spacy_models = {}
+# Pipeline components never loaded: only NER + sentences are used, and the
+# rule-based sentencizer replaces the (much slower) parser for sentences
+SPACY_EXCLUDED_PIPES = ["tagger", "morphologizer", "parser", "attribute_ruler", "lemmatizer"]
+SPACY_BATCH_SIZE = 64
 # Lazy-loaded YAKE extractors
 yake_extractors = {}
+# Lazy-loaded KeyBERT model (one multilingual model covers en/de/fr/it);
+# only ever loaded in the main process, see main()
+KEYBERT_MODEL_NAME = "paraphrase-multilingual-MiniLM-L12-v2"
+KEYBERT_BATCH_SIZE = 512
+keybert_model = None
 
 # Regex patterns that match disclaimer/footer lines to remove
 BOILERPLATE_PATTERNS = [
@@ -187,9 +219,70 @@ BOILERPLATE_PATTERNS = [
     # r"^Diesen\sBeitrag\steilen$"
 ]
 
+# Python's \s (Unicode whitespace) minus "\n", spelled out so re and RE2 agree
+LINE_SPACE_CHARS = "\t\x0b\x0c\r\x1c-\x1f \x85\xa0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000"
+
+def line_local(pattern: str) -> str:
+    r"""
+    Rewrite \s / \S (outside character classes) so they never match "\n":
+    in the fused multi-line regex a pattern must not reach into the next line.
+    """
+    classes = {r"\s": f"[{LINE_SPACE_CHARS}]", r"\S": f"[^{LINE_SPACE_CHARS}\n]"}
+    return re.sub(r"\\.", lambda m: classes.get(m.group(), m.group()), pattern)
+
+def compile_boilerplate_regex(patterns: list[str]):
+    """
+    Fuse all patterns into one regex that removes every *line* containing a
+    match (same rule as searching each stripped line). Uses RE2 when it is
+    installed and accepts the patterns, otherwise Python's re.
+    """
+    # flags inline: google-re2 has no IGNORECASE / MULTILINE constants
+    fused = r"(?im)^[^\n]*?(?:" + "|".join(map(line_local, patterns)) + r")[^\n]*(?:\n|$)"
+    if re2 is not None:
+        try:
+            return re2.compile(fused)
+        except re2.error as e:
+            logging.warning(f"RE2 rejected boilerplate patterns, using re: {e}")
+    return re.compile(fused)
+
+BOILERPLATE_RE = compile_boilerplate_regex(BOILERPLATE_PATTERNS)
+# Any line boundary str.splitlines() knows, with the whitespace around it
+# (what ln.strip() would remove); empty lines are dropped anyway, so runs
+# collapse to a single "\n"
+LINE_EDGES_RE = re.compile(r"\s*[\n\r\x0b\x0c\x1c-\x1e\x85\u2028\u2029]\s*")
+
+# Path segments for the YYYY/MM folder layout
+YEAR_RE = re.compile(r"\d{4}")
+MONTH_RE = re.compile(r"0[1-9]|1[0-2]")
+
+def iter_json_files(root: Path):
+    """
+    Yield every *.json file below root, walking the tree lazily with
+    os.scandir (no up-front list of the whole corpus).
+    """
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.endswith(".json"):
+                        yield Path(entry.path)
+        except OSError as e:
+            logging.error(f"Cannot list directory: {e}")
+
+def paragraph_fingerprint(paragraph: str) -> int:
+    """
+    Stable 64-bit fingerprint of a paragraph, used as the key of the
+    repeat-frequency table instead of the full paragraph string.
+    """
+    digest = hashlib.blake2b(paragraph.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
 def get_spacy_model(lang_code: str):
     """
-    Lazy-load spaCy for 'en' or 'de'.
+    Lazy-load spaCy for 'en' or 'de' with only NER + a sentencizer.
     """
     model_map = {"en": "en_core_web_sm", "de": "de_core_news_sm"}
     if lang_code not in model_map:
@@ -197,7 +290,8 @@ def get_spacy_model(lang_code: str):
     if lang_code in spacy_models:
         return spacy_models[lang_code]
     try:
-        nlp = spacy.load(model_map[lang_code])
+        nlp = spacy.load(model_map[lang_code], exclude=SPACY_EXCLUDED_PIPES)
+        nlp.add_pipe("sentencizer", first=True)
         spacy_models[lang_code] = nlp
         return nlp
     except Exception as e:
@@ -207,15 +301,23 @@ def get_spacy_model(lang_code: str):
 def detect_lang(text: str) -> str:
     """
     Use Lingua to detect language. Return ISO639-1 code like 'en', 'de', etc.
+    Only the first LANG_DETECT_PREFIX characters are inspected, and results
+    are memoized so repeated texts are detected once.
     """
     if not text.strip():
         return ""
+    prefix = text[:LANG_DETECT_PREFIX]
+    key = paragraph_fingerprint(prefix)
+    if key in detect_lang_cache:
+        return detect_lang_cache[key]
     try:
-        lang = detector.detect_language_of(text)
-        return lang.iso_code_639_1.name.lower() if lang else ""
+        lang = detector.detect_language_of(prefix)
+        code = lang.iso_code_639_1.name.lower() if lang else ""
     except Exception as e:
         logging.error(f"Language detection error: {e}")
         return ""
+    detect_lang_cache[key] = code
+    return code
 
 def parse_date_from_path(file_path: Path):
     """
@@ -226,9 +328,9 @@ def parse_date_from_path(file_path: Path):
     month = None
     # e.g. if path has segments: "2023/05"
     for part in file_path.parts:
-        if re.fullmatch(r"\d{4}", part):
+        if YEAR_RE.fullmatch(part):
             year = part
-        elif re.fullmatch(r"(0[1-9]|1[0-2])", part):
+        elif MONTH_RE.fullmatch(part):
             if year:
                 month = part.zfill(2)
 
@@ -237,19 +339,35 @@ def parse_date_from_path(file_path: Path):
         return iso_date, int(year), int(month) if month else 1
     return "", None, None
 
-def extract_entities_spacy(text: str, lang_code: str):
+def run_spacy_batched(texts: list[str], langs: list[str]) -> list:
     """
-    Named Entity Recognition with spaCy if model is available.
+    Run spaCy over all texts at once, one nlp.pipe() stream per language.
+    Returns (named_entities, sentences) per text, or None where no model exists.
+    """
+    results = [None] * len(texts)
+    for lang_code in sorted(set(langs)):
+        nlp = get_spacy_model(lang_code)
+        if not nlp:
+            continue
+        indices = [i for i, lc in enumerate(langs) if lc == lang_code]
+        docs = nlp.pipe((texts[i] for i in indices), batch_size=SPACY_BATCH_SIZE)
+        for i, doc in zip(indices, docs):
+            sents = [s.text.strip() for s in doc.sents if s.text.strip()]
+            results[i] = (extract_entities_spacy(doc), sents)
+    return results
+
+def extract_entities_spacy(doc):
+    """
+    Named Entity Recognition from an already processed spaCy Doc.
+    Entities are de-duplicated per (label, lower-cased text); the first
+    spelling seen is kept.
     """
-    nlp = get_spacy_model(lang_code)
-    if not nlp:
-        return []
-    doc = nlp(text)
     seen = set()
     ents = []
     for e in doc.ents:
-        if e.text not in seen:
-            seen.add(e.text)
+        key = (e.label_, e.text.lower())
+        if key not in seen:
+            seen.add(key)
             ents.append({"text": e.text, "label": e.label_})
     return ents
 
@@ -272,17 +390,48 @@ def extract_keywords_yake(text: str, lang_code: str, top_k=10):
     extractor = yake_extractors[yake_lang]
     try:
         kw_sc = extractor.extract_keywords(text)
-        # sort by ascending score
-        kw_sc.sort(key=lambda x: x[1])
-        return [k for k,_ in kw_sc[:top_k]]
+        # top_k lowest (= best) scores, without sorting the whole list
+        best = heapq.nsmallest(top_k, kw_sc, key=lambda x: x[1])
+        return [k for k,_ in best]
     except Exception as e:
         logging.error(f"YAKE extract error: {e}")
         return []
 
-def simple_summary(text: str, lang_code: str, max_bullets=3):
+def extract_keywords_keybert(texts: list[str], top_k=10) -> list[list[str]]:
+    """
+    KeyBERT keyword extraction for a whole batch of texts: the sentence-
+    transformers forward pass is vectorised across the batch.
+    """
+    global keybert_model
+    if keybert_model is None:
+        keybert_model = KeyBERT(KEYBERT_MODEL_NAME)
+
+    keywords = [[] for _ in texts]
+    indices = [i for i, text in enumerate(texts) if text.strip()]
+    if not indices:
+        return keywords
+    try:
+        results = keybert_model.extract_keywords(
+            [texts[i] for i in indices],
+            keyphrase_ngram_range=(1, 3),
+            stop_words=None,          # multilingual corpus: no English stop list
+            top_n=top_k,
+            use_mmr=True,
+        )
+    except Exception as e:
+        logging.error(f"KeyBERT extract error: {e}")
+        return keywords
+    # a single document comes back as a flat list
+    if len(indices) == 1:
+        results = [results]
+    for i, kw_sc in zip(indices, results):
+        keywords[i] = [k for k, _ in kw_sc]
+    return keywords
+
+def simple_summary(text: str, sents=None, max_bullets=3):
     """
     1) If bullet lines exist, return first n bullet lines.
-    2) Else attempt spaCy sentence splitting, returning first 1-2 sentences.
+    2) Else use spaCy sentences (if given), returning first 1-2 sentences.
     3) Else naive split on punctuation.
     """
     lines = text.splitlines()
@@ -291,10 +440,7 @@ def simple_summary(text: str, lang_code: str, max_bullets=3):
         return "\n".join(bullet_lines[:max_bullets])
 
     # spaCy approach
-    nlp = get_spacy_model(lang_code)
-    if nlp:
-        doc = nlp(text)
-        sents = [s.text.strip() for s in doc.sents if s.text.strip()]
+    if sents is not None:
         if len(sents) >= 2:
             return sents[0] + " " + sents[1]
         elif sents:
@@ -314,100 +460,62 @@ def remove_boilerplate_in_paragraphs(paragraphs: list[str]) -> list[str]:
     Remove lines matching disclaimers or repeated boilerplate from each paragraph.
     Returns updated list of paragraphs without those lines.
     """
-    combined_regex = re.compile("|".join(BOILERPLATE_PATTERNS), re.IGNORECASE)
     cleaned_paras = []
     for para in paragraphs:
-        # Split paragraph by lines
-        lines = para.splitlines()
-        # Filter out any lines that match BOILERPLATE_PATTERNS
-        filtered_lines = [
-            ln for ln in lines
-            if not combined_regex.search(ln.strip())
-        ]
-        # Recombine into a single paragraph
-        new_para = " ".join(fl.strip() for fl in filtered_lines if fl.strip())
+        # Strip every line in one pass so the ^…$ patterns see bare lines
+        text = LINE_EDGES_RE.sub("\n", para.strip())
+        # Drop all lines matching BOILERPLATE_PATTERNS in a single sub
+        text = BOILERPLATE_RE.sub("", text)
+        # Recombine the remaining lines into a single paragraph
+        new_para = " ".join(ln for ln in text.split("\n") if ln)
         if new_para:
             cleaned_paras.append(new_para)
     return cleaned_paras
 
-def main():
-    parser = argparse.ArgumentParser(description="Step 2: remove repeated paragraphs, disclaimers, add advanced metadata.")
-    parser.add_argument("input_dir", help="Directory with JSON from step_1_hybrid.")
-    parser.add_argument("output_dir", help="Directory for final structured JSON.")
-    parser.add_argument("--threshold", type=int, default=5,
-                        help="Remove paragraphs repeated >= threshold times.")
-    args = parser.parse_args()
-
-    in_dir = Path(args.input_dir)
-    out_dir = Path(args.output_dir)
-    out_dir.mkdir(parents=True, exist_ok=True)
-
-    start_time = time.time()
-
-    # 1) Gather documents & remove textual disclaimers from paragraphs
-    docs = []
-    paragraph_counts = {}
-
-    json_files = list(in_dir.rglob("*.json"))
-    for js_path in json_files:
-        try:
-            data = json.loads(js_path.read_text(encoding="utf-8"))
-        except Exception as e:
-            logging.error(f"Error reading {js_path}: {e}")
-            continue
-
-        original_paras = data.get("paragraphs", [])
-
-        # Step 1.1: Remove disclaimers/footers from paragraphs
-        refined_paras = remove_boilerplate_in_paragraphs(original_paras)
+def process_doc_batch(tasks: list[tuple], in_dir: Path, out_dir: Path) -> int:
+    """
+    Worker: language detection, spaCy, keywords and summary for a batch of
+    (js_path, doc_fields, cleaned_paras, keywords), writing one JSON per doc.
+    keywords are precomputed KeyBERT results, or None for YAKE here.
+    spaCy/YAKE models are lazy-loaded once per worker process.
+    Returns the number of records written.
+    """
+    final_texts = ["\n".join(cleaned_paras) for _, _, cleaned_paras, _ in tasks]
+    langs = [detect_lang(text) for text in final_texts]
 
-        # We'll keep track of these refined paras in memory
-        docs.append((js_path, data, refined_paras))
-        # For building the frequency dictionary
-        for p in refined_paras:
-            paragraph_counts[p] = paragraph_counts.get(p, 0) + 1
+    # spaCy NER + sentences for the whole batch in one nlp.pipe() stream
+    spacy_results = run_spacy_batched(final_texts, langs)
 
-    # 2) Identify repeated paragraphs above threshold
-    threshold = args.threshold
-    logging.info(f"Repeat paragraph threshold set to {threshold}.")
+    # Keywords: precomputed by KeyBERT in the parent, else YAKE doc by doc
+    batch_keywords = [keywords if keywords is not None else extract_keywords_yake(text, lang)
+                      for (_, _, _, keywords), text, lang in zip(tasks, final_texts, langs)]
 
-    # 3) For each doc, remove repeated paragraphs, extract metadata
     out_count = 0
-    for js_path, data, refined_paras in docs:
-        # Filter out paragraphs that appear too frequently
-        cleaned_paras = [p for p in refined_paras if paragraph_counts[p] < threshold]
-
-        # Rejoin them into final text
-        final_text = "\n".join(cleaned_paras)
-
+    for (js_path, data, cleaned_paras, _), final_text, lang, spacy_res, keywords in zip(
+            tasks, final_texts, langs, spacy_results, batch_keywords):
         # — Advanced metadata —
-        # Language detection
-        lang = detect_lang(final_text)
-
         # Attempt date parse from directory structure (optional)
         iso_date, year_int, month_int = parse_date_from_path(js_path.relative_to(in_dir))
 
-        # Named entities
-        named_ents = extract_entities_spacy(final_text, lang)
-        # Keywords
-        keywords = extract_keywords_yake(final_text, lang)
+        # Named entities + sentences (None if no spaCy model for this language)
+        named_ents, sents = spacy_res if spacy_res else ([], None)
         # Summary
-        summ = simple_summary(final_text, lang)
+        summ = simple_summary(final_text, sents)
 
         # Build final record
         final_record = {
-            "doc_id": data.get("doc_id", ""),
-            "filename": data.get("filename", ""),
+            "doc_id": data["doc_id"],
+            "filename": data["filename"],
             "domain": "ethz.ch",  # or parse from path if you prefer
             "language": lang,
-            "title": data.get("title", ""),
+            "title": data["title"],
             "date": iso_date,
             "year": year_int,
             "month": month_int,
             "source": "ETH News",
             # final text after disclaimers + repeated paragraphs removed
             "main_content": final_text,
-            "paragraphs_original": data.get("paragraphs", []),
+            "paragraphs_original": data["paragraphs"],
             "paragraphs_cleaned": cleaned_paras,
             "named_entities": named_ents,
             "keywords": keywords,
@@ -430,12 +538,90 @@ def main():
         out_path.parent.mkdir(parents=True, exist_ok=True)
 
         try:
-            with open(out_path, "w", encoding="utf-8") as f:
-                json.dump(final_record, f, indent=2, ensure_ascii=False)
+            out_path.write_bytes(orjson.dumps(final_record, option=orjson.OPT_INDENT_2))
             out_count += 1
             logging.info(f"Processed => {out_path}")
         except Exception as e:
             logging.error(f"Error writing {out_path}: {e}")
+    return out_count
+
+def main():
+    parser = argparse.ArgumentParser(description="Step 2: remove repeated paragraphs, disclaimers, add advanced metadata.")
+    parser.add_argument("input_dir", help="Directory with JSON from step_1_hybrid.")
+    parser.add_argument("output_dir", help="Directory for final structured JSON.")
+    parser.add_argument("--threshold", type=int, default=5,
+                        help="Remove paragraphs repeated >= threshold times.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Worker processes for metadata extraction (default: CPU count).")
+    parser.add_argument("--keywords", choices=["yake", "keybert"], default="yake",
+                        help="Keyword extractor: per-doc YAKE (default) or batched KeyBERT "
+                             "(run once in the main process).")
+    args = parser.parse_args()
+    if args.keywords == "keybert" and KeyBERT is None:
+        parser.error("--keywords keybert requires the 'keybert' package (pip install keybert).")
+
+    in_dir = Path(args.input_dir)
+    out_dir = Path(args.output_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    start_time = time.time()
+
+    # 1) Gather documents & remove textual disclaimers from paragraphs
+    docs = []
+    paragraph_counts = Counter()
+
+    for js_path in iter_json_files(in_dir):
+        try:
+            data = orjson.loads(js_path.read_bytes())
+        except Exception as e:
+            logging.error(f"Error reading {js_path}: {e}")
+            continue
+
+        original_paras = data.get("paragraphs", [])
+
+        # Step 1.1: Remove disclaimers/footers from paragraphs
+        refined_paras = remove_boilerplate_in_paragraphs(original_paras)
+
+        # Fingerprints are reused below, so each paragraph is hashed once
+        fingerprints = [paragraph_fingerprint(p) for p in refined_paras]
+        # We'll keep track of these refined paras in memory
+        docs.append((js_path, data, refined_paras, fingerprints))
+        # For building the frequency dictionary
+        paragraph_counts.update(fingerprints)
+
+    # 2) Identify repeated paragraphs above threshold
+    threshold = args.threshold
+    logging.info(f"Repeat paragraph threshold set to {threshold}.")
+
+    # 3) Remove repeated paragraphs; only the fields the record needs are
+    #    shipped to the workers (not raw_text, not the counts table)
+    tasks = []
+    for js_path, data, refined_paras, fingerprints in docs:
+        cleaned_paras = [p for p, fp in zip(refined_paras, fingerprints)
+                         if paragraph_counts[fp] < threshold]
+        doc_fields = {k: data.get(k, default) for k, default in
+                      (("doc_id", ""), ("filename", ""), ("title", ""), ("paragraphs", []))}
+        tasks.append((js_path, doc_fields, cleaned_paras, None))
+    docs.clear()
+
+    # KeyBERT runs here, in the parent: one copy of the model (and torch)
+    # instead of one per worker, and large embedding batches
+    if args.keywords == "keybert":
+        for start in range(0, len(tasks), KEYBERT_BATCH_SIZE):
+            chunk = tasks[start:start + KEYBERT_BATCH_SIZE]
+            keywords = extract_keywords_keybert(["\n".join(cleaned_paras) for _, _, cleaned_paras, _ in chunk])
+            tasks[start:start + KEYBERT_BATCH_SIZE] = [
+                (js_path, doc_fields, cleaned_paras, kws)
+                for (js_path, doc_fields, cleaned_paras, _), kws in zip(chunk, keywords)]
+
+    # 4) Metadata extraction & write, batches of docs spread over worker processes
+    #    (smaller batches on small corpora so every worker gets some)
+    n_workers = args.workers or os.cpu_count() or 1
+    size = max(1, min(SPACY_BATCH_SIZE, -(-len(tasks) // n_workers)))
+    batches = [tasks[i:i + size] for i in range(0, len(tasks), size)]
+    worker = partial(process_doc_batch, in_dir=in_dir, out_dir=out_dir)
+    with ProcessPoolExecutor(max_workers=n_workers) as ex:
+        out_count = sum(ex.map(worker, batches))
 
     dur = time.time() - start_time
     logging.info(f"Completed advanced cleaning for {out_count} docs in {dur:.2f}s.")
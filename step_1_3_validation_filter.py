@@ -14,20 +14,90 @@ Example:
 """
 
 import os
-import json
+import ijson
+import shutil
 import logging
+import tempfile
 import argparse
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 
-def has_nonempty_cleaned_paragraphs(record: dict) -> bool:
+# Copies are syscall-bound and release the GIL, so many threads overlap well
+# (plain threads, not aiofiles: these files are small)
+WRITE_THREADS = 32
+
+def scan_record(buf: bytes):
+    """
+    Stream through one JSON document without building it in memory.
+    Returns (is_dict, doc_id, has_nonempty_cleaned_paragraphs).
+    """
+    events = ijson.parse(buf)
+    _, first_event, _ = next(events)
+    if first_event != "start_map":
+        return False, None, False
+
+    doc_id = "unknown"
+    nonempty = False
+    opened = False  # just saw the '[' of a top-level paragraphs_cleaned
+    for prefix, event, value in events:
+        if opened:
+            # the first event after '[' is either ']' (empty) or an item
+            nonempty = not (prefix == "paragraphs_cleaned" and event == "end_array")
+            opened = False
+        if prefix == "doc_id" and event in ("string", "number", "boolean", "null"):
+            doc_id = value
+        elif prefix == "paragraphs_cleaned" and event in (
+                "start_array", "start_map", "string", "number", "boolean", "null"):
+            # a later duplicate key wins, like with json.load
+            nonempty = False
+            opened = event == "start_array"
+    return True, doc_id, nonempty
+
+def load_and_validate(path: Path):
+    """
+    Worker: check one JSON file against the paragraphs_cleaned rule.
+    Returns the doc_id of a valid record, else None. Rejected files never
+    get a dict built; valid ones are copied byte-for-byte by the caller.
+    """
+    try:
+        buf = path.read_bytes()
+        # cheap pre-filter: without the key the record can't be valid
+        if b'"paragraphs_cleaned"' not in buf:
+            return None
+        is_dict, doc_id, nonempty = scan_record(buf)
+    except Exception as e:
+        logging.warning(f"Error reading {path}: {e}")
+        return None
+
+    # If it's not a dict, skip
+    if not is_dict:
+        logging.warning(f"Invalid record format in {path}; skipping.")
+        return None
+
+    # Apply the single rule: remove if paragraphs_cleaned is empty
+    if not nonempty:
+        return None
+    return doc_id
+
+def copy_record(src: Path, out_path: Path) -> None:
     """
-    Check that paragraphs_cleaned is a non-empty list.
+    Copy one valid record unchanged (runs in the writer thread pool).
+    Goes through a unique tmp file + rename, so out_path is never half-written.
     """
-    paragraphs_cleaned = record.get("paragraphs_cleaned", [])
-    # If it's not a list or if it's empty, we discard the record
-    return isinstance(paragraphs_cleaned, list) and len(paragraphs_cleaned) > 0
+    tmp_path = None
+    try:
+        # path-style doc_ids (step_1_hybrid --id-hash path) contain "/"
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=out_path.parent, suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, out_path)
+    except Exception as e:
+        logging.warning(f"Could not write file {out_path}: {e}")
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
 
 def main():
     parser = argparse.ArgumentParser(
@@ -41,45 +111,30 @@ def main():
     output_dir = Path(args.output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    valid_records = []
-    count_files = 0
-
-    # Traverse all .json files in input_dir
-    for path in input_dir.rglob("*.json"):
-        if not path.is_file():
-            continue
-        count_files += 1
-
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                record = json.load(f)
-        except Exception as e:
-            logging.warning(f"Error reading {path}: {e}")
-            continue
-
-        # If it's not a dict, skip
-        if not isinstance(record, dict):
-            logging.warning(f"Invalid record format in {path}; skipping.")
-            continue
-
-        # Apply the single rule: remove if paragraphs_cleaned is empty
-        if has_nonempty_cleaned_paragraphs(record):
-            valid_records.append(record)
+    # Traverse all .json files in input_dir (sorted: stable, directory-ordered)
+    paths = sorted(path for path in input_dir.rglob("*.json") if path.is_file())
+    count_files = len(paths)
+    valid_count = 0
+
+    # Stream-validate in worker processes (chunksize amortizes IPC over many
+    # small files). Records sharing a doc_id (e.g. "unknown") map to the same
+    # output file: as in a serial run, the last one in sorted order wins.
+    targets = {}
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+        for path, doc_id in zip(paths, pool.map(load_and_validate, paths, chunksize=64)):
+            if doc_id is None:
+                continue
+            targets[output_dir / f"{doc_id}.json"] = path
+            valid_count += 1
+
+    # Copy the valid files unchanged from a thread pool, one copy per output path
+    with ThreadPoolExecutor(max_workers=max(1, min(WRITE_THREADS, len(targets)))) as writers:
+        for out_path, path in targets.items():
+            writers.submit(copy_record, path, out_path)
 
     logging.info(f"Scanned {count_files} JSON files in '{input_dir}'.")
-    logging.info(f"{len(valid_records)} records passed the paragraphs_cleaned check.")
-
-    # Write valid records to output_dir
-    for rec in valid_records:
-        doc_id = rec.get("doc_id", "unknown")
-        out_path = output_dir / f"{doc_id}.json"
-        try:
-            with open(out_path, "w", encoding="utf-8") as f:
-                json.dump(rec, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            logging.warning(f"Could not write file {out_path}: {e}")
-
-    logging.info(f"Wrote {len(valid_records)} valid records to '{output_dir}'.")
+    logging.info(f"{valid_count} records passed the paragraphs_cleaned check.")
+    logging.info(f"Wrote {len(targets)} valid records to '{output_dir}'.")
 
 if __name__ == "__main__":
     main()
@@ -1,9 +1,179 @@
 import pdfplumber
 import re
-import json
+import orjson
 import os
 import argparse
 
+try:
+    # Optional: native (MuPDF) text extraction, much faster – pip install pymupdf
+    import pymupdf
+except ImportError:
+    pymupdf = None
+
+try:
+    # Optional: Aho–Corasick keyword matching – pip install pyahocorasick
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Ordered (regex, replacement) pairs; the result is that of one re.sub after another.
+OCR_REPLACEMENTS = [
+    # Remove or adapt these original ones if they conflict:
+    # (r"compeZZve", "competitive"),  # If you no longer see "compeZZve" in your text, you can remove.
+    (r"compeZZon", "competition"),
+    (r"compeZZve", "competitive"),
+    (r"iniZaZve", "initiative"),
+    (r"addiZonal", "additional"),
+    (r"mulZple", "multiple"),
+    (r"opZon", "option"),
+    (r"miZgaZng", "mitigating"),
+    (r"producZvity", "productivity"),
+    (r"projecZons", "projections"),
+    (r"direcZon", "direction"),
+    (r"capabiliZes", "capabilities"),
+    (r"deveZop", "develop"),
+    (r"seZngs", "settings"),
+    (r"explaZion", "explanation"),
+    (r"quesZon", "question"),
+    (r"quesZons", "questions"),
+    (r"elevaZon", "elevation"),
+    (r"elevaZons", "elevations"),
+    (r"organizaZon", "organization"),
+    (r"acZvely", "actively"),
+    (r"experZse", "expertise"),
+    (r"collaboraZons", "collaborations"),
+    (r"condiZons", "conditions"),
+    (r"iniZaZves", "initiatives"),
+    (r"insZtuZonal", "institutional"),
+    (r"insZtuZon", "institution"),
+    (r"insZtute", "institute"),
+    (r"parZcular", "particular"),
+    (r"addiZon", "addition"),
+    (r"conZnues", "continues"),
+    (r"acceleraZon", "acceleration"),
+    (r"deflecZon", "deflection"),
+
+    # IMPORTANT: Remove these fallback lines so we do NOT replace every 'Z' or every 'T':
+    # (r"Z", "ti"),  # <-- Remove this (commented out)
+    # (r"T", "ll"),  # <-- Remove this (commented out)
+
+    # We do keep this pipe symbol fix, if needed:
+    (r"\|", "l"),
+
+    # Remove "PaTern" -> "Pattern" if not seen, or keep if you do see it:
+    (r"PaTern", "Pattern"),
+
+    # Now ADD the explicit fixes to match the final JSON exactly:
+    (r"EllH", "ETH"),
+    (r"tiurich", "Zurich"),
+    (r"lladeus", "Tadeus"),
+    (r"llilman", "Tilman"),
+    (r"llumor", "Tumor"),
+    (r" llanDEM-X", " TanDEM-X"),
+    (r"Engimmune llherapeutics", "Engimmune Therapeutics"),
+
+    # Some lines from the extracted text often had small OCR quirks:
+    (r"swiwly", "swiftly"),
+    (r"culng-edge", "cutting-edge"),
+    (r"shiw", "shift"),
+    (r"pallern", "pattern"),
+
+    # If your text turned "Anthony Patt" into "Anthony Pall", fix it if needed:
+    (r"Anthony Pall", "Anthony Patt"),
+
+    # Fix "Net tiero" -> "Net Zero"
+    (r"Net tiero", "Net-Zero"),  # for Q12
+    (r"Net tiero", "Net Zero"),  # if you have multiple occurrences, or unify them
+
+    # If your text turned TCRs into llCRs:
+    (r"llCRs", "TCRs"),
+
+    # If your text turned "ElioT" into "Elioll", etc.:
+    (r"Elioll Ash", "ElioT Ash"),
+    (r"Sebastino Cantalupo", "SebasZno Cantalupo"),
+    (r"Christian Degen", "ChrisZan Degen"),
+
+    # In case some lines had "Thomas" or "Tobias" incorrectly:
+    (r"llobias Donner", "Tobias Donner"),
+
+    # If your text had "Rachel Granoe" spelled differently, correct as needed:
+    # (Add or remove lines if you see more tiny mismatches.)
+]
+
+_REGEX_META = set(".^$*+?{}[]\\|()")
+
+def _literals_interact(a, b):
+    """True if literal a and b can overlap in some text (incl. one inside the other)."""
+    if a in b or b in a:
+        return True
+    return any(a.endswith(b[:k]) or b.endswith(a[:k])
+               for k in range(1, min(len(a), len(b))))
+
+def _compile_replacements(pairs):
+    """
+    Turn the ordered (regex, replacement) list into as few passes as possible
+    while giving exactly the result of one re.sub after another.
+    Consecutive plain-text patterns are fused into one alternation with a
+    dict lookup, as long as none of them can overlap another's match or the
+    replacement of an earlier one in the same pass (e.g. 'producZvity' vs.
+    'deveZop', which share a 'p'); otherwise a new pass starts. Any pattern
+    using regex syntax gets its own pass, so order-dependent fixes
+    (e.g. '|' -> 'l' before 'EllH') hold.
+    Returns a list of (compiled_pattern, replacement) where the replacement
+    is a string or a callable.
+    """
+    passes = []
+    table = {}
+
+    def flush():
+        if table:
+            fused = re.compile("|".join(re.escape(lit) for lit in table))
+            lookup = dict(table)
+            passes.append((fused, lambda m: lookup[m.group(0)]))
+            table.clear()
+
+    for pat, repl in pairs:
+        if any(c in _REGEX_META for c in pat):
+            flush()
+            passes.append((re.compile(pat), repl))
+            continue
+        if any(_literals_interact(pat, lit) or _literals_interact(pat, out)
+               for lit, out in table.items()):
+            flush()
+        table[pat] = repl
+    flush()
+    return passes
+
+OCR_PASSES = _compile_replacements(OCR_REPLACEMENTS)
+
+# Q&A layout: "12. Question text", answer/notes lines until the next number
+Q_RE = re.compile(r"^(\d+)\.\s+(.+)")
+NEXT_Q_RE = re.compile(r"^\d+\.\s")
+# A line with any of these marks the start of scoring notes ...
+NOTE_KWS = ('score', 'point', 'criterion', 'criteria', 'explanation', 'should',
+            'note', 'this is about', 'deflect', 'ambiguous', 'answer should')
+# ... but the notes are only kept if their first line has one of these
+NOTE_CONFIRM_KWS = ('score', 'point', 'criterion', 'criteria', 'deflect', 'ambiguous',
+                    'explanation', 'answer should', 'note')
+
+def _build_automaton(keywords):
+    """One Aho–Corasick automaton for all keywords (None without pyahocorasick)."""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for kw in keywords:
+        automaton.add_word(kw, kw)
+    automaton.make_automaton()
+    return automaton
+
+NOTE_AUTOMATON = _build_automaton(NOTE_KWS)
+
+def has_note_keyword(lower):
+    """True if the lowercased line contains any of NOTE_KWS (single pass when possible)."""
+    if NOTE_AUTOMATON is not None:
+        return next(NOTE_AUTOMATON.iter(lower), None) is not None
+    return any(keyword in lower for keyword in NOTE_KWS)
+
 def fix_ocr_typos(text):
     """
     Fix only the specific OCR artifacts that differ from the final 'correct version.'
@@ -14,94 +184,27 @@ def fix_ocr_typos(text):
     (like 'culng-edge' -> 'cutting-edge', 'swiwly' -> 'swiftly', etc.) to match exactly
     the final JSON text.
     """
-    replacements = [
-        # Remove or adapt these original ones if they conflict:
-        # (r"compeZZve", "competitive"),  # If you no longer see "compeZZve" in your text, you can remove.
-        (r"compeZZon", "competition"),
-        (r"compeZZve", "competitive"),
-        (r"iniZaZve", "initiative"),
-        (r"addiZonal", "additional"),
-        (r"mulZple", "multiple"),
-        (r"opZon", "option"),
-        (r"miZgaZng", "mitigating"),
-        (r"producZvity", "productivity"),
-        (r"projecZons", "projections"),
-        (r"direcZon", "direction"),
-        (r"capabiliZes", "capabilities"),
-        (r"deveZop", "develop"),
-        (r"seZngs", "settings"),
-        (r"explaZion", "explanation"),
-        (r"quesZon", "question"),
-        (r"quesZons", "questions"),
-        (r"elevaZon", "elevation"),
-        (r"elevaZons", "elevations"),
-        (r"organizaZon", "organization"),
-        (r"acZvely", "actively"),
-        (r"experZse", "expertise"),
-        (r"collaboraZons", "collaborations"),
-        (r"condiZons", "conditions"),
-        (r"iniZaZves", "initiatives"),
-        (r"insZtuZonal", "institutional"),
-        (r"insZtuZon", "institution"),
-        (r"insZtute", "institute"),
-        (r"parZcular", "particular"),
-        (r"addiZon", "addition"),
-        (r"conZnues", "continues"),
-        (r"acceleraZon", "acceleration"),
-        (r"deflecZon", "deflection"),
-
-        # IMPORTANT: Remove these fallback lines so we do NOT replace every 'Z' or every 'T':
-        # (r"Z", "ti"),  # <-- Remove this (commented out)
-        # (r"T", "ll"),  # <-- Remove this (commented out)
-
-        # We do keep this pipe symbol fix, if needed:
-        (r"\|", "l"),
-
-        # Remove "PaTern" -> "Pattern" if not seen, or keep if you do see it:
-        (r"PaTern", "Pattern"),
-
-        # Now ADD the explicit fixes to match the final JSON exactly:
-        (r"EllH", "ETH"),
-        (r"tiurich", "Zurich"),
-        (r"lladeus", "Tadeus"),
-        (r"llilman", "Tilman"),
-        (r"llumor", "Tumor"),
-        (r" llanDEM-X", " TanDEM-X"),
-        (r"Engimmune llherapeutics", "Engimmune Therapeutics"),
-
-        # Some lines from the extracted text often had small OCR quirks:
-        (r"swiwly", "swiftly"),
-        (r"culng-edge", "cutting-edge"),
-        (r"shiw", "shift"),
-        (r"pallern", "pattern"),
-
-        # If your text turned "Anthony Patt" into "Anthony Pall", fix it if needed:
-        (r"Anthony Pall", "Anthony Patt"),
-
-        # Fix "Net tiero" -> "Net Zero"
-        (r"Net tiero", "Net-Zero"),  # for Q12
-        (r"Net tiero", "Net Zero"),  # if you have multiple occurrences, or unify them
-
-        # If your text turned TCRs into llCRs:
-        (r"llCRs", "TCRs"),
-
-        # If your text turned "ElioT" into "Elioll", etc.:
-        (r"Elioll Ash", "ElioT Ash"),
-        (r"Sebastino Cantalupo", "SebasZno Cantalupo"),
-        (r"Christian Degen", "ChrisZan Degen"),
-
-        # In case some lines had "Thomas" or "Tobias" incorrectly:
-        (r"llobias Donner", "Tobias Donner"),
-
-        # If your text had "Rachel Granoe" spelled differently, correct as needed:
-        # (Add or remove lines if you see more tiny mismatches.)
-    ]
-    for pat, repl in replacements:
-        text = re.sub(pat, repl, text)
+    for pattern, repl in OCR_PASSES:
+        text = pattern.sub(repl, text)
     return text
 
 
 
+def extract_pdf_text(pdf_path, force_pdfplumber=False):
+    """
+    Return the text of all pages joined by newlines. Uses PyMuPDF when it is
+    installed; pdfplumber (pure Python, slower) when forced or as fallback.
+    """
+    if pymupdf is not None and not force_pdfplumber:
+        try:
+            with pymupdf.open(pdf_path) as doc:
+                return "\n".join(page.get_text("text") for page in doc)
+        except Exception as e:
+            print(f"PyMuPDF failed ({e}); falling back to pdfplumber")
+    with pdfplumber.open(pdf_path) as pdf:
+        return "\n".join(page.extract_text() for page in pdf.pages)
+
+
 # Patch for split Q12 (specific to your file structure)
 def merge_q12(qa_pairs):
     for i, qa in enumerate(qa_pairs):
@@ -125,14 +228,18 @@ def main():
         "output_path",
         help="Path to the output JSON file (e.g., ../data_cleaned/benchmark_qa.json)"
     )
+    parser.add_argument(
+        "--pdfplumber",
+        action="store_true",
+        help="Extract text with pdfplumber instead of PyMuPDF (slower, original layout handling)"
+    )
     args = parser.parse_args()
 
     # Create output directory if it doesn't exist
     os.makedirs(os.path.dirname(args.output_path), exist_ok=True)
 
     # Extract text from PDF
-    with pdfplumber.open(args.pdf_path) as pdf:
-        all_text = "\n".join(page.extract_text() for page in pdf.pages)
+    all_text = extract_pdf_text(args.pdf_path, force_pdfplumber=args.pdfplumber)
 
     # Clean OCR issues line by line
     lines = [fix_ocr_typos(line.strip()) for line in all_text.splitlines()]
@@ -140,7 +247,7 @@ def main():
     qa_pairs = []
     i = 0
     while i < len(lines):
-        q_match = re.match(r"^(\d+)\.\s+(.+)", lines[i])
+        q_match = Q_RE.match(lines[i])
         if q_match:
             q_id = int(q_match.group(1))
             question = q_match.group(2).strip()
@@ -149,7 +256,7 @@ def main():
             answer_lines = []
             j = i + 1
             while j < len(lines):
-                if re.match(r"^\d+\.\s", lines[j]):  # Next question => break
+                if NEXT_Q_RE.match(lines[j]):  # Next question => break
                     break
                 if lines[j] == "":
                     j += 1
@@ -162,20 +269,15 @@ def main():
             is_note = False
             for l in answer_lines:
                 # If line looks like scoring/explanation => treat as note
-                if any(keyword in l.lower() for keyword in [
-                    'score', 'point', 'criterion', 'criteria', 'explanation', 'should',
-                    'note', 'this is about', 'deflect', 'ambiguous', 'answer should'
-                ]):
-                    is_note = True
+                if not is_note:
+                    is_note = has_note_keyword(l.lower())
                 if is_note:
                     notes.append(l)
                 else:
                     answer.append(l)
 
             # Sometimes the answer is just long lines, and "notes" might not be actual notes
-            if notes and not any(kw in notes[0].lower() for kw in
-                                 ['score', 'point', 'criterion', 'criteria', 'deflect', 'ambiguous',
-                                  'explanation', 'answer should', 'note']):
+            if notes and not any(kw in notes[0].lower() for kw in NOTE_CONFIRM_KWS):
                 answer += notes
                 notes = []
 
@@ -209,11 +311,11 @@ def main():
             qa["notes"] = qa["notes"].strip()
 
     # Save to JSON
-    with open(args.output_path, "w", encoding="utf-8") as fout:
-        json.dump(qa_pairs, fout, indent=2, ensure_ascii=False)
+    with open(args.output_path, "wb") as fout:
+        fout.write(orjson.dumps(qa_pairs, option=orjson.OPT_INDENT_2))
 
     # Print first 3 to verify
-    print(json.dumps(qa_pairs[:3], indent=2, ensure_ascii=False))
+    print(orjson.dumps(qa_pairs[:3], option=orjson.OPT_INDENT_2).decode("utf-8"))
     print(f"\nSuccessfully extracted {len(qa_pairs)} Q&A pairs to {args.output_path}")
 
 
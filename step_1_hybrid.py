@@ -3,13 +3,13 @@
 Script: step_1_hybrid.py
 Purpose:
   Minimal HTML parsing using a hybrid approach:
-    - BeautifulSoup to remove large boilerplate elements (scripts, styles, nav, etc.)
+    - selectolax (lxml fallback) to remove large boilerplate elements (scripts, styles, nav, etc.)
     - Docling for robust text extraction from the stripped HTML.
     - Outputs only minimal JSON fields.
 
 Resulting JSON schema:
 {
-  "doc_id": str,        # unique identifier (SHA-1 or file_path stem)
+  "doc_id": str,        # unique identifier (hash of the relative path, or the path itself)
   "filename": str,      # original filename
   "raw_text": str,      # entire cleaned text
   "paragraphs": [ ... ] # naive list of paragraphs
@@ -22,112 +22,214 @@ Example:
 """
 
 import os
-import re
-import json
+import orjson
 import time
 import logging
 import argparse
 import unicodedata
 import hashlib
+from io import BytesIO
 from pathlib import Path
-import tempfile
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 
+import lxml.html
+from lxml import etree
 from bs4 import BeautifulSoup
-from docling.document_converter import DocumentConverter
+from docling.document_converter import DocumentConverter, HtmlFormatOption
+from docling.datamodel.base_models import DocumentStream, InputFormat
+
+try:
+    # Optional: SIMD-accelerated hashing for --id-hash blake3 – pip install blake3
+    from blake3 import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    # Optional: C HTML parser, much faster than bs4 – pip install selectolax
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 
-converter = DocumentConverter()
+# One DocumentConverter per worker process (Docling models are not fork-safe),
+# created by _init_worker() as the pool's initializer
+converter = None
+
+def _init_worker():
+    """
+    Process-pool initializer: build this process's DocumentConverter.
+    Only the HTML pipeline is allowed and initialized, so no PDF layout,
+    OCR or table-structure models are ever loaded.
+    """
+    global converter
+    converter = DocumentConverter(
+        allowed_formats=[InputFormat.HTML],
+        format_options={InputFormat.HTML: HtmlFormatOption()},
+    )
+    converter.initialize_pipeline(InputFormat.HTML)
+
+# Elements removed (with their content) before Docling sees the page
+BOILERPLATE_TAGS = ("script", "style", "header", "footer", "nav", "aside", "img", "figure")
 
-def strip_boilerplate_with_bs(html_text: str) -> str:
+# Fallback stripper state, built once per process instead of once per page
+_LXML_PARSER = lxml.html.HTMLParser(remove_blank_text=True, remove_comments=True, encoding="utf-8")
+_BOILERPLATE_XPATH = etree.XPath("|".join(f"//{tag}" for tag in BOILERPLATE_TAGS))
+
+def strip_boilerplate(raw_html: bytes) -> str:
+    """
+    Remove BOILERPLATE_TAGS with selectolax (parsing and removal happen in C,
+    no Python node objects). selectolax takes the raw UTF-8 bytes, so the page
+    is never decoded to a Python str up front. Falls back to lxml if
+    selectolax is not installed or fails on the input.
+    """
+    if HTMLParser is not None:
+        try:
+            tree = HTMLParser(raw_html, decode_errors="ignore")
+            for selector in BOILERPLATE_TAGS:
+                for node in tree.css(selector):
+                    node.decompose()
+            return tree.html or ""
+        except Exception as e:
+            logging.warning(f"selectolax failed, falling back to lxml: {e}")
+    return strip_boilerplate_with_lxml(raw_html)
+
+def strip_boilerplate_with_lxml(raw_html: bytes) -> str:
     """
-    Remove known boilerplate tags using BeautifulSoup, returning an HTML string
-    that's lighter for Docling to process.
+    Remove known boilerplate tags using lxml, returning an HTML string
+    that's lighter for Docling to process. Reuses the module-level parser
+    and a single XPath query for all BOILERPLATE_TAGS.
     """
-    soup = BeautifulSoup(html_text, "lxml")
+    try:
+        tree = lxml.html.fromstring(raw_html, parser=_LXML_PARSER)
+    except etree.ParserError:
+        # empty / whitespace-only document
+        return ""
+    if tree.tag in BOILERPLATE_TAGS:
+        return ""
 
-    for tag in soup(["script", "style", "header", "footer", "nav", "aside", "img", "figure"]):
-        tag.decompose()
+    for el in _BOILERPLATE_XPATH(tree):
+        # drop_tree() keeps the element's tail text, like bs4's decompose()
+        if el.getparent() is not None:
+            el.drop_tree()
 
     # If you'd like, you could also remove known repetitive text or disclaimers here
     # but let's keep it minimal for now.
 
-    return str(soup)
+    return lxml.html.tostring(tree, encoding="unicode")
 
 def docling_extraction(cleaned_html: str) -> str:
     """
     Feed the stripped HTML to docling.DocumentConverter and return extracted text.
     If Docling fails, fallback to plain text extraction from BeautifulSoup.
     """
-    with tempfile.NamedTemporaryFile(suffix=".html", delete=False) as tmp:
-        tmp.write(cleaned_html.encode("utf-8"))
-        tmp.flush()
-        tmp_path = tmp.name
+    # hand the HTML to Docling in memory – no temp file write/unlink per page
+    source = DocumentStream(name="page.html", stream=BytesIO(cleaned_html.encode("utf-8")))
 
+    if converter is None:
+        _init_worker()
     try:
-        conv_result = converter.convert(tmp_path)
+        conv_result = converter.convert(source)
         doc_text = conv_result.document.export_to_text()
     except Exception as e:
         logging.error(f"Docling extraction error: {e}")
         # fallback: extract text with BeautifulSoup's get_text
         doc_text = BeautifulSoup(cleaned_html, "lxml").get_text(separator="\n")
-    finally:
-        os.remove(tmp_path)
 
     return doc_text
 
-def normalize_lines(text: str) -> str:
+def normalize_and_split(text: str) -> tuple[str, list[str]]:
+    """
+    One pass over the extracted text: NFC-normalize and strip each line,
+    drop empty lines. Returns (raw_text joined with single newlines,
+    paragraphs). With blank lines already gone there is nothing to group
+    on, so each remaining line is one paragraph.
+    """
+    lines = []
+    for ln in text.splitlines():
+        ln = ln.strip()
+        if ln:
+            lines.append(unicodedata.normalize("NFC", ln))
+    return "\n".join(lines), lines
+
+def make_doc_id(rel_path: str, id_hash: str = "sha1") -> str:
     """
-    Normalize unicode, strip each line, remove empty lines,
-    and re-join with single newlines.
+    Stable doc_id from the relative path: SHA-1 (default, matches existing
+    data), a 16-byte BLAKE3 digest, or with "path" no hash at all – the
+    relative path minus its .html suffix, which keeps IDs grep-able.
     """
-    lines = [
-        unicodedata.normalize("NFC", ln.strip())
-        for ln in text.splitlines()
-        if ln.strip()
-    ]
-    return "\n".join(lines)
+    if id_hash == "path":
+        return rel_path.removesuffix(".html")
+    data = rel_path.encode("utf-8")
+    if id_hash == "blake3":
+        return blake3(data).hexdigest(16)
+    return hashlib.sha1(data).hexdigest()
+
+# Pre-filter: files smaller than this, or without an HTML marker in their
+# first SNIFF_BYTES, never reach Docling
+MIN_HTML_BYTES = 256
+SNIFF_BYTES = 512
+HTML_MARKERS = (b"<html", b"<!doctype")
 
-def naive_paragraph_split(text: str) -> list[str]:
+def prefilter_html(html_files: list[Path]) -> list[Path]:
     """
-    Split on blank lines. If there's only one chunk, fallback to splitting on each line.
+    Cheap pass before the pool: drop tiny files, files that don't sniff as
+    HTML, and byte-identical duplicates (by content digest, first path wins).
     """
-    paras = re.split(r"\n\s*\n+", text)
-    paras = [p.strip() for p in paras if p.strip()]
-    if len(paras) <= 1:
-        # fallback: each line is its own paragraph
-        paras = [ln.strip() for ln in text.splitlines() if ln.strip()]
-    return paras
+    kept, seen = [], set()
+    small = not_html = dupes = 0
+    for html_file in html_files:
+        try:
+            if html_file.stat().st_size < MIN_HTML_BYTES:
+                small += 1
+                continue
+            data = html_file.read_bytes()
+        except OSError as e:
+            logging.error(f"Failed to read {html_file}: {e}")
+            continue
+        head = data[:SNIFF_BYTES].lower()
+        if not any(marker in head for marker in HTML_MARKERS):
+            not_html += 1
+            continue
+        digest = blake3(data).digest() if blake3 is not None else hashlib.blake2b(data, digest_size=16).digest()
+        if digest in seen:
+            dupes += 1
+            continue
+        seen.add(digest)
+        kept.append(html_file)
+    logging.info(f"Pre-filter: skipped {small} small, {not_html} non-HTML, {dupes} duplicate files; "
+                 f"{len(kept)} left.")
+    return kept
 
-def process_single_file(html_file: Path, in_base: Path) -> dict:
+def process_single_file(html_file: Path, in_base: Path, id_hash: str = "sha1") -> dict:
     """
-    1. Compute doc_id (via SHA-1 of relative path).
-    2. Read HTML file.
-    3. Strip boilerplate with BeautifulSoup.
+    1. Compute doc_id (hash of relative path, see make_doc_id).
+    2. Read HTML file (raw bytes).
+    3. Strip boilerplate with selectolax / lxml.
     4. Extract text with Docling.
     5. Normalize lines & split into paragraphs.
     6. Return minimal record.
     """
     # 1) doc_id
     rel_path = html_file.relative_to(in_base).as_posix()
-    doc_id = hashlib.sha1(rel_path.encode("utf-8")).hexdigest()
+    doc_id = make_doc_id(rel_path, id_hash)
 
     # 2) read the HTML
     try:
-        raw_html = html_file.read_text(encoding="utf-8", errors="ignore")
+        raw_html = html_file.read_bytes()
     except Exception as e:
         logging.error(f"Failed to read {html_file}: {e}")
         return {}
 
     # 3) strip boilerplate
-    stripped_html = strip_boilerplate_with_bs(raw_html)
+    stripped_html = strip_boilerplate(raw_html)
 
     # 4) docling extraction
     extracted = docling_extraction(stripped_html)
 
     # 5) normalize & paragraph split
-    raw_text = normalize_lines(extracted)
-    paragraphs = naive_paragraph_split(raw_text)
+    raw_text, paragraphs = normalize_and_split(extracted)
 
     # 6) build record
     record = {
@@ -138,11 +240,31 @@ def process_single_file(html_file: Path, in_base: Path) -> dict:
     }
     return record
 
+def _work(html_file: Path, in_base: Path, id_hash: str = "sha1"):
+    """
+    Pool task: process one file and serialize it in the worker.
+    Returns (html_file, output path relative to out_dir, JSON bytes) or None.
+    """
+    record = process_single_file(html_file, in_base, id_hash)
+    if not record:
+        # indicates an error or empty result
+        return None
+    # output path mirrors relative structure
+    rel_out = html_file.relative_to(in_base).with_suffix(".json")
+    return html_file, rel_out, orjson.dumps(record, option=orjson.OPT_INDENT_2)
+
 def main():
-    parser = argparse.ArgumentParser(description="Step 1: Hybrid minimal parse (BS+Docling).")
+    parser = argparse.ArgumentParser(description="Step 1: Hybrid minimal parse (selectolax/lxml+Docling).")
     parser.add_argument("input_dir", help="Directory containing .html files.")
     parser.add_argument("output_dir", help="Directory to store minimal JSON.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Parallel worker processes (default: CPU count).")
+    parser.add_argument("--id-hash", choices=["sha1", "blake3", "path"], default="sha1",
+                        help="Hash of the relative path used as doc_id, or 'path' to use the "
+                             "relative path itself (default: sha1, matches existing data).")
     args = parser.parse_args()
+    if args.id_hash == "blake3" and blake3 is None:
+        parser.error("--id-hash blake3 requires the 'blake3' package (pip install blake3).")
 
     in_dir = Path(args.input_dir)
     out_dir = Path(args.output_dir)
@@ -151,26 +273,27 @@ def main():
     start_time = time.time()
     count = 0
 
-    for html_file in in_dir.rglob("*.html"):
-        if not html_file.is_file():
-            continue
-
-        record = process_single_file(html_file, in_dir)
-        if not record:
-            # indicates an error or empty result
-            continue
+    # Collect once, sorted: deterministic order and a known total for the pool
+    html_files = sorted(p for p in in_dir.rglob("*.html") if p.is_file())
+    logging.info(f"Found {len(html_files)} HTML files in '{in_dir}'.")
+    html_files = prefilter_html(html_files)
 
-        # output path mirrors relative structure
-        rel = html_file.relative_to(in_dir)
-        out_path = out_dir / rel.with_suffix(".json")
-        out_path.parent.mkdir(parents=True, exist_ok=True)
+    # Parsing + Docling run in worker processes; each Docling call takes
+    # seconds, so a small chunksize keeps the workers evenly loaded
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker) as ex:
+        for result in ex.map(partial(_work, in_base=in_dir, id_hash=args.id_hash), html_files, chunksize=4):
+            if result is None:
+                continue
+            html_file, rel_out, payload = result
+            out_path = out_dir / rel_out
+            out_path.parent.mkdir(parents=True, exist_ok=True)
 
-        # write JSON
-        with open(out_path, "w", encoding="utf-8") as f:
-            json.dump(record, f, indent=2, ensure_ascii=False)
+            # write JSON
+            with open(out_path, "wb") as f:
+                f.write(payload)
 
-        logging.info(f"[STEP1] {html_file} => {out_path}")
-        count += 1
+            logging.info(f"[STEP1] {html_file} => {out_path}")
+            count += 1
 
     dur = time.time() - start_time
     logging.info(f"Completed minimal hybrid parsing of {count} files in {dur:.2f}s.")